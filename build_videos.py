@@ -10,21 +10,37 @@ Steps:
    - Payload: raw WebM bytes
 
 No decoding or parsing of WebM is performed; bytes are copied verbatim.
+With --stream, FFmpeg's WebM output is piped straight into the .video file
+instead of going through an intermediate .webm on disk. Piped WebM has no
+Cues index or duration, so streamed payloads are not seekable.
 """
 
 from __future__ import annotations
 
 import argparse
+import functools
+import hashlib
+import itertools
+import json
+import math
+import mmap
 import os
 import shutil
 import struct
 import subprocess
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 MAGIC = b"VID0"
 VERSION = 1
 HEADER_STRUCT = struct.Struct("<4sIQ")  # magic, version, webm_size
+# Magic and version never change, so only the size needs packing per file.
+HEADER_PREFIX = MAGIC + struct.pack("<I", VERSION)
+SIZE_STRUCT = struct.Struct("<Q")
+COPY_BUF = 4 * 1024 * 1024
 
 VIDEO_EXTS = {
     ".mp4",
@@ -38,41 +54,116 @@ VIDEO_EXTS = {
     ".wmv",
     ".flv",
 }
+VIDEO_EXTS_TUPLE = tuple(sorted(VIDEO_EXTS))
+
+# Options that change the encoded bytes, and so belong in the cache key.
+CACHE_KEY_ARGS = (
+    "encoder",
+    "hwaccel",
+    "crf",
+    "deadline",
+    "cpu_used",
+    "threads_per_job",
+    "segment_seconds",
+    "batch",
+    "audio",
+    "audio_bitrate",
+)
+
+# Keep ffmpeg quiet unless something goes wrong.
+FFMPEG_LOG_ARGS = ["-hide_banner", "-nostats", "-loglevel", "error"]
+
+# Only encoders that emit VP9 are usable: the .video payload must stay WebM/VP9.
+HW_ENCODERS = {
+    "qsv": "vp9_qsv",
+    "vaapi": "vp9_vaapi",
+}
 
 
-def run_ffmpeg(
-    src: Path,
-    dst_webm: Path,
-    args: argparse.Namespace,
-    ffmpeg_path: str,
-    ffmpeg_lib_dir: str | None,
-) -> None:
-    cmd = [
-        ffmpeg_path,
-        "-y" if args.force else "-n",
-        "-i",
-        str(src),
-        "-c:v",
-        "libvpx-vp9",
-        "-b:v",
-        "0",
-        "-crf",
-        str(args.crf),
-        "-row-mt",
-        "1",
-        "-deadline",
-        args.deadline,
-        "-cpu-used",
-        str(args.cpu_used),
-    ]
+def input_args(args: argparse.Namespace) -> list[str]:
+    if args.hwaccel == "vaapi":
+        return ["-vaapi_device", args.vaapi_device]
+    return []
 
-    if args.audio:
-        cmd += ["-c:a", "libopus", "-b:a", f"{args.audio_bitrate}k"]
+
+def encoder_codec(args: argparse.Namespace) -> str:
+    if args.hwaccel:
+        return HW_ENCODERS[args.hwaccel]
+    if args.encoder == "svt-vp9":
+        return "libsvt_vp9"
+    return "libvpx-vp9"
+
+
+def encoder_args(args: argparse.Namespace, tile_cols: int) -> list[str]:
+    if args.hwaccel == "qsv":
+        if args.cpu_used >= 5:
+            preset = "veryfast"
+        elif args.cpu_used >= 2:
+            preset = "medium"
+        else:
+            preset = "veryslow"
+        cmd = [
+            "-pix_fmt",
+            "nv12",
+            "-c:v",
+            "vp9_qsv",
+            "-global_quality",
+            str(args.crf),
+            "-preset",
+            preset,
+        ]
+    elif args.hwaccel == "vaapi":
+        # vp9_vaapi takes a raw 0-255 q index; libvpx maps crf onto it at roughly 4x.
+        cmd = [
+            "-vf",
+            "format=nv12,hwupload",
+            "-c:v",
+            "vp9_vaapi",
+            "-global_quality",
+            str(min(255, args.crf * 4)),
+        ]
+    elif args.encoder == "svt-vp9":
+        # SVT-VP9 sizes its own thread pool; --deadline/--threads-per-job don't apply.
+        cmd = [
+            "-c:v",
+            "libsvt_vp9",
+            "-preset",
+            str(args.cpu_used),
+            "-rc",
+            "0",
+            "-qp",
+            str(args.crf),
+        ]
     else:
-        cmd += ["-an"]
+        cmd = [
+            "-c:v",
+            "libvpx-vp9",
+            "-b:v",
+            "0",
+            "-crf",
+            str(args.crf),
+            "-row-mt",
+            "1",
+            "-deadline",
+            args.deadline,
+            "-cpu-used",
+            str(args.cpu_used),
+            "-threads",
+            str(args.threads_per_job),
+            "-tile-columns",
+            str(tile_cols),
+        ]
+
+    return cmd
+
+
+def audio_args(args: argparse.Namespace) -> list[str]:
+    if args.audio:
+        return ["-c:a", "libopus", "-b:a", f"{args.audio_bitrate}k"]
+    return ["-an"]
 
-    cmd += [str(dst_webm)]
 
+def ffmpeg_env(ffmpeg_lib_dir: str | None) -> dict[str, str]:
     env = os.environ.copy()
     if ffmpeg_lib_dir:
         if os.name == "nt":
@@ -81,22 +172,452 @@ def run_ffmpeg(
             env["DYLD_LIBRARY_PATH"] = ffmpeg_lib_dir + os.pathsep + env.get("DYLD_LIBRARY_PATH", "")
         else:
             env["LD_LIBRARY_PATH"] = ffmpeg_lib_dir + os.pathsep + env.get("LD_LIBRARY_PATH", "")
+    return env
 
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
-    if proc.returncode != 0:
-        raise RuntimeError(f"ffmpeg failed for {src}\n{proc.stdout}")
+
+def tile_columns(src: Path, args: argparse.Namespace, ffmpeg_path: str, env: dict[str, str]) -> int:
+    # libvpx tiles are at least 256px wide and -tile-columns is log2 of their count.
+    if encoder_codec(args) != "libvpx-vp9":
+        return 0
+    try:
+        streams = probe_input(src, resolve_ffprobe(ffmpeg_path), env).get("streams", [])
+        width = next(int(s["width"]) for s in streams if s.get("codec_type") == "video")
+    except (FileNotFoundError, RuntimeError, StopIteration, KeyError, ValueError):
+        return 2
+    return tile_columns_for_width(width)
+
+
+def tile_columns_for_width(width: int) -> int:
+    if width < 512:
+        return 0
+    return min(6, int(math.log2(width / 256)))
+
+
+def run_ffmpeg_cmd(cmd: list[str], src: Path, env: dict[str, str]) -> None:
+    # Output only matters on failure, so spool it to disk instead of holding it in memory.
+    cmd = [cmd[0], *FFMPEG_LOG_ARGS, *cmd[1:]]
+    with tempfile.TemporaryFile() as log:
+        proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=env)
+        if proc.returncode != 0:
+            log.seek(0)
+            raise RuntimeError(f"ffmpeg failed for {src}\n{log.read().decode(errors='replace')}")
+
+
+def run_ffmpeg(
+    src: Path,
+    dst_webm: Path,
+    args: argparse.Namespace,
+    ffmpeg_path: str,
+    env: dict[str, str],
+    tile_cols: int | None = None,
+) -> None:
+    if tile_cols is None:
+        tile_cols = tile_columns(src, args, ffmpeg_path, env)
+
+    cmd = [ffmpeg_path, "-y", *input_args(args), "-i", str(src)]
+    cmd += encoder_args(args, tile_cols)
+    cmd += audio_args(args)
+    cmd += [str(dst_webm)]
+    run_ffmpeg_cmd(cmd, src, env)
+
+
+def staging_file(dst: Path) -> Path:
+    # Hidden, unique per writer and beside dst, so the final os.replace is an atomic rename.
+    while True:
+        tmp = dst.with_name(f".{dst.name}.{os.urandom(4).hex()}.tmp")
+        try:
+            # 0o666 lets the umask set the mode, as a plain open() would.
+            fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return tmp
+
+
+def pipe_to_video(
+    cmd: list[str],
+    src: Path,
+    dst_video: Path,
+    env: dict[str, str],
+    drop_cache: bool = False,
+) -> None:
+    # WebM goes out over a pipe, so the size field is patched in once ffmpeg hits EOF.
+    cmd = [cmd[0], *FFMPEG_LOG_ARGS, *cmd[1:]]
+    tmp = staging_file(dst_video)
+    try:
+        with tempfile.TemporaryFile() as log:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=log, env=env)
+            try:
+                with tmp.open("wb") as fout:
+                    fout.write(HEADER_PREFIX + bytes(SIZE_STRUCT.size))
+                    total = copy_stream(proc.stdout, fout)
+                    fout.seek(len(HEADER_PREFIX))
+                    fout.write(SIZE_STRUCT.pack(total))
+                    if drop_cache:
+                        fout.flush()
+                        drop_page_cache(fout.fileno(), dirty=True)
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+
+            if returncode != 0:
+                log.seek(0)
+                raise RuntimeError(f"ffmpeg failed for {src}\n{log.read().decode(errors='replace')}")
+    except BaseException:
+        # Covers Popen failing too, so no staging file is left behind.
+        tmp.unlink(missing_ok=True)
+        raise
+
+    # Publishing by rename also breaks any hardlink into the cache instead of writing through it.
+    os.replace(tmp, dst_video)
+
+
+def stream_to_video(
+    src: Path,
+    dst_video: Path,
+    args: argparse.Namespace,
+    ffmpeg_path: str,
+    env: dict[str, str],
+    tile_cols: int | None = None,
+) -> None:
+    if tile_cols is None:
+        tile_cols = tile_columns(src, args, ffmpeg_path, env)
+
+    cmd = [ffmpeg_path, *input_args(args), "-i", str(src)]
+    cmd += encoder_args(args, tile_cols)
+    cmd += audio_args(args)
+    cmd += ["-f", "webm", "pipe:1"]
+    pipe_to_video(cmd, src, dst_video, env, args.drop_cache)
+
+
+def write_concat_list(path: Path, files: list[Path]) -> None:
+    path.write_text(
+        "".join("file '{}'\n".format(str(p.resolve()).replace("'", "'\\''")) for p in files),
+        encoding="utf-8",
+    )
+
+
+def wait_all(futures: list[Future]):
+    # Yields results as they finish; cancels whatever hasn't started on the first failure.
+    try:
+        for fut in as_completed(futures):
+            yield fut.result()
+    except BaseException:
+        for fut in futures:
+            fut.cancel()
+        raise
 
 
-def wrap_webm_to_video(src_webm: Path, dst_video: Path, force: bool) -> None:
-    if dst_video.exists() and not force:
-        raise FileExistsError(f"Output exists: {dst_video}")
+def segment_input(src: Path, tmpdir: Path, seconds: float, ffmpeg_path: str, env: dict[str, str]) -> list[Path]:
+    # Stream copy can only cut on existing keyframes, so segments run at least `seconds` long.
+    cmd = [
+        ffmpeg_path,
+        "-y",
+        "-i",
+        str(src),
+        "-map",
+        "0:v:0",
+        "-c",
+        "copy",
+        "-f",
+        "segment",
+        "-segment_time",
+        str(seconds),
+        "-reset_timestamps",
+        "1",
+        str(tmpdir / "%06d.mkv"),
+    ]
+    run_ffmpeg_cmd(cmd, src, env)
+    return sorted(tmpdir.glob("*.mkv"))
+
 
+def encode_segmented(
+    src: Path,
+    args: argparse.Namespace,
+    ffmpeg_path: str,
+    env: dict[str, str],
+    pool: ThreadPoolExecutor,
+) -> Path:
+    stem = src.stem
+    video_path = args.out / f"{stem}.video"
+
+    # Segments are video-only; audio is taken from the source in the final concat.
+    seg_args = argparse.Namespace(**vars(args))
+    seg_args.audio = False
+
+    with tempfile.TemporaryDirectory(prefix=f".{stem}-segments-", dir=args.out) as tmp:
+        tmpdir = Path(tmp)
+        segments = segment_input(src, tmpdir, args.segment_seconds, ffmpeg_path, env)
+        encoded = [seg.with_suffix(".webm") for seg in segments]
+        tile_cols = tile_columns(src, args, ffmpeg_path, env)
+        futures = [
+            pool.submit(run_ffmpeg, seg, out, seg_args, ffmpeg_path, env, tile_cols)
+            for seg, out in zip(segments, encoded)
+        ]
+        for _ in wait_all(futures):
+            pass
+
+        concat_list = tmpdir / "concat.txt"
+        write_concat_list(concat_list, encoded)
+
+        cmd = [ffmpeg_path, "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+        if args.audio:
+            cmd += ["-i", str(src), "-map", "0:v", "-map", "1:a:0?"]
+        # Drop metadata inherited from the first segment, or the stale duration ends up in the output.
+        cmd += ["-map_metadata", "-1", "-c:v", "copy"]
+        cmd += audio_args(args)
+
+        if args.stream and not args.keep_webm:
+            pipe_to_video(cmd + ["-f", "webm", "pipe:1"], src, video_path, env, args.drop_cache)
+            return video_path
+
+        # Unless it is kept, the joined .webm lives and dies with the segment directory.
+        webm_path = args.out / f"{stem}.webm" if args.keep_webm else tmpdir / f"{stem}.webm"
+        run_ffmpeg_cmd(cmd + [str(webm_path)], src, env)
+        wrap_webm_to_video(webm_path, video_path, args.drop_cache)
+
+    return video_path
+
+
+def resolve_ffprobe(ffmpeg_path: str) -> str:
+    return _resolve_ffprobe(ffmpeg_path, os.environ.get("PATH", ""))
+
+
+@functools.lru_cache(maxsize=8)
+def _resolve_ffprobe(ffmpeg_path: str, path_env: str) -> str:
+    # Prefer the ffprobe shipped next to the ffmpeg in use.
+    ffmpeg = Path(ffmpeg_path)
+    sibling = ffmpeg.with_name(ffmpeg.name.replace("ffmpeg", "ffprobe"))
+    if sibling != ffmpeg and sibling.exists():
+        return str(sibling)
+
+    ffprobe = shutil.which("ffprobe", path=path_env)
+    if ffprobe is None:
+        raise FileNotFoundError("ffprobe not found next to ffmpeg or in PATH")
+    return ffprobe
+
+
+def probe_input(src: Path, ffprobe_path: str, env: dict[str, str]) -> dict:
+    cmd = [
+        ffprobe_path,
+        "-v",
+        "error",
+        "-show_entries",
+        "stream=index,codec_type,codec_name,width,height,pix_fmt,r_frame_rate,sample_rate,channels:format=duration",
+        "-of",
+        "json",
+        str(src),
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {src}\n{proc.stderr}")
+    return json.loads(proc.stdout)
+
+
+def batch_groups(
+    srcs: list[Path],
+    ffprobe_path: str,
+    env: dict[str, str],
+    audio: bool,
+) -> list[list[tuple[Path, float, int]]]:
+    # The concat demuxer matches streams by index, so group by the full stream layout.
+    groups: dict[tuple, list[tuple[Path, float, int]]] = {}
+    singles = []
+    for src in srcs:
+        try:
+            info = probe_input(src, ffprobe_path, env)
+        except (RuntimeError, json.JSONDecodeError):
+            # Let the per-file path encode it, or report the real ffmpeg error.
+            singles.append([(src, 0.0, 0)])
+            continue
+        streams = info.get("streams", [])
+        video = [s for s in streams if s.get("codec_type") == "video"]
+        sound = [s for s in streams if s.get("codec_type") == "audio"]
+        try:
+            duration = float(info["format"]["duration"])
+        except (KeyError, ValueError):
+            duration = 0.0
+        if len(video) != 1 or duration <= 0 or (audio and len(sound) > 1):
+            singles.append([(src, duration, 0)])
+            continue
+
+        v = video[0]
+        layout = tuple((s.get("index"), s.get("codec_type")) for s in streams)
+        key = layout + (v.get("codec_name"), v.get("width"), v.get("height"), v.get("pix_fmt"), v.get("r_frame_rate"))
+        if audio:
+            key += tuple((a.get("codec_name"), a.get("sample_rate"), a.get("channels")) for a in sound)
+        groups.setdefault(key, []).append((src, duration, int(v.get("width") or 0)))
+
+    return [*groups.values(), *singles]
+
+
+def split_batch(group: list[tuple[Path, float, int]], jobs: int) -> list[list[tuple[Path, float, int]]]:
+    # One ffmpeg per group would leave the rest of the pool idle; spread it over ~jobs runs.
+    size = -(-len(group) // max(1, min(jobs, len(group))))
+    return [group[i : i + size] for i in range(0, len(group), size)]
+
+
+def encode_batch(
+    group: list[tuple[Path, float, int]],
+    args: argparse.Namespace,
+    ffmpeg_path: str,
+    env: dict[str, str],
+) -> list[Path]:
+    if len(group) == 1:
+        src, _, width = group[0]
+        tile_cols = tile_columns_for_width(width) if width else None
+        return [encode_one(src, args, ffmpeg_path, env, tile_cols)]
+
+    srcs = [src for src, _, _ in group]
+    video_paths = [args.out / f"{src.stem}.video" for src in srcs]
+
+    # Keyframes are forced at every input boundary so the segment muxer can cut there.
+    bounds = ",".join(f"{t:.6f}" for t in itertools.accumulate(d for _, d, _ in group[:-1]))
+    with tempfile.TemporaryDirectory(prefix=".batch-", dir=args.out) as tmp:
+        tmpdir = Path(tmp)
+        concat_list = tmpdir / "concat.txt"
+        write_concat_list(concat_list, srcs)
+
+        cmd = [ffmpeg_path, "-y", *input_args(args), "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+        # Width is part of the group key, so the probe from batch_groups covers the whole batch.
+        cmd += encoder_args(args, tile_columns_for_width(group[0][2]))
+        cmd += audio_args(args)
+        cmd += [
+            "-force_key_frames",
+            bounds,
+            "-f",
+            "segment",
+            "-segment_format",
+            "webm",
+            "-segment_times",
+            bounds,
+            "-reset_timestamps",
+            "1",
+            str(tmpdir / "%06d.webm"),
+        ]
+        run_ffmpeg_cmd(cmd, srcs[0], env)
+
+        segments = sorted(tmpdir.glob("*.webm"))
+        if len(segments) != len(srcs):
+            raise RuntimeError(f"Batch encode produced {len(segments)} segments for {len(srcs)} inputs")
+
+        for seg, video_path in zip(segments, video_paths):
+            if args.keep_webm:
+                webm_path = video_path.with_suffix(".webm")
+                os.replace(seg, webm_path)
+                seg = webm_path
+            wrap_webm_to_video(seg, video_path, args.drop_cache)
+
+    return video_paths
+
+
+def ffmpeg_encoders(ffmpeg_path: str, env: dict[str, str]) -> set[str]:
+    proc = subprocess.run(
+        [ffmpeg_path, "-hide_banner", "-encoders"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg -encoders failed\n{proc.stdout}")
+
+    names = set()
+    for line in proc.stdout.splitlines():
+        parts = line.split()
+        # Encoder rows look like " V....D libvpx-vp9   libvpx VP9 ..."
+        if len(parts) >= 2 and len(parts[0]) == 6:
+            names.add(parts[1])
+    return names
+
+
+def _kernel_copy(copy, in_fd: int, out_fd: int, size: int) -> bool:
+    # Returns False if the syscall is unusable here and nothing was copied yet.
+    offset = 0
+    while offset < size:
+        try:
+            sent = copy(in_fd, out_fd, offset, size - offset)
+        except OSError:
+            if offset == 0:
+                return False
+            raise
+        if sent == 0:
+            if offset == 0:
+                return False
+            raise RuntimeError(f"Short copy: {offset} of {size} bytes")
+        offset += sent
+    return True
+
+
+def copy_stream(fin, fout, bufsize: int = COPY_BUF) -> int:
+    # One reusable buffer instead of a fresh bytes object per chunk.
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    total = 0
+    while n := fin.readinto(buf):
+        fout.write(view[:n])
+        total += n
+    return total
+
+
+def copy_payload(fin, fout, size: int) -> None:
+    fout.flush()
+    in_fd, out_fd = fin.fileno(), fout.fileno()
+
+    if hasattr(os, "copy_file_range"):
+        if _kernel_copy(lambda i, o, off, n: os.copy_file_range(i, o, n, off), in_fd, out_fd, size):
+            return
+    if hasattr(os, "sendfile"):
+        if _kernel_copy(lambda i, o, off, n: os.sendfile(o, i, off, n), in_fd, out_fd, size):
+            return
+
+    # Small payloads don't need the full buffer.
+    copy_stream(fin, fout, min(COPY_BUF, max(1 << 20, size // 16)))
+
+
+def advise_sequential(fd: int) -> None:
+    # Let the kernel read ahead of the copy loop.
+    if not hasattr(os, "posix_fadvise"):
+        return
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+
+def drop_page_cache(fd: int, dirty: bool = False) -> None:
+    if not hasattr(os, "posix_fadvise"):
+        return
+    # Dirty pages can't be evicted until they have been written back.
+    if dirty:
+        os.fdatasync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def wrap_webm_to_video(src_webm: Path, dst_video: Path, drop_cache: bool = False) -> None:
     size = src_webm.stat().st_size
-    header = HEADER_STRUCT.pack(MAGIC, VERSION, size)
+    header = HEADER_PREFIX + SIZE_STRUCT.pack(size)
 
-    with src_webm.open("rb") as fin, dst_video.open("wb") as fout:
-        fout.write(header)
-        shutil.copyfileobj(fin, fout, length=1024 * 1024)
+    tmp = staging_file(dst_video)
+    try:
+        with src_webm.open("rb") as fin, tmp.open("wb") as fout:
+            advise_sequential(fin.fileno())
+            if hasattr(os, "posix_fallocate") and size:
+                # Reserve the full length up front for a contiguous layout.
+                try:
+                    os.posix_fallocate(fout.fileno(), 0, HEADER_STRUCT.size + size)
+                except OSError:
+                    pass
+            fout.write(header)
+            copy_payload(fin, fout, size)
+            if drop_cache:
+                fout.flush()
+                drop_page_cache(fin.fileno())
+                drop_page_cache(fout.fileno(), dirty=True)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    # Publishing by rename also breaks any hardlink into the cache instead of writing through it.
+    os.replace(tmp, dst_video)
 
 
 def iter_inputs(src: Path, recursive: bool) -> list[Path]:
@@ -106,14 +627,40 @@ def iter_inputs(src: Path, recursive: bool) -> list[Path]:
     if not src.is_dir():
         raise FileNotFoundError(f"Input path not found: {src}")
 
-    pattern = "**/*" if recursive else "*"
-    files = [p for p in src.glob(pattern) if p.is_file() and p.suffix.lower() in VIDEO_EXTS]
-    return sorted(files)
-
-
-def resolve_ffmpeg(args: argparse.Namespace) -> tuple[str, str | None]:
-    if args.ffmpeg:
-        return args.ffmpeg, None
+    # scandir reuses the dirent type, so most entries never need a stat call.
+    matches = []
+    pending = deque([src])
+    while pending:
+        path = pending.popleft()
+        try:
+            it = os.scandir(path)
+        except PermissionError:
+            # Like Path.glob, skip unreadable subdirectories instead of failing the build.
+            if path is src:
+                raise
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+                # Bare names like ".mp4" have no suffix, matching Path.suffix semantics.
+                name = entry.name.lower()
+                if name.endswith(VIDEO_EXTS_TUPLE) and name not in VIDEO_EXTS and entry.is_file():
+                    matches.append(entry.path)
+    return sorted(Path(p) for p in matches)
+
+
+def resolve_ffmpeg(ffmpeg_arg: str) -> tuple[str, str | None]:
+    return _resolve_ffmpeg(ffmpeg_arg, os.environ.get("PATH", ""))
+
+
+# Keyed on PATH too, so a changed environment never returns a stale lookup.
+@functools.lru_cache(maxsize=8)
+def _resolve_ffmpeg(ffmpeg_arg: str, path_env: str) -> tuple[str, str | None]:
+    if ffmpeg_arg:
+        return ffmpeg_arg, None
 
     tool_root = Path(__file__).resolve().parent
     bundled = tool_root / "third_party" / "ffmpeg" / "bin" / "ffmpeg"
@@ -123,33 +670,195 @@ def resolve_ffmpeg(args: argparse.Namespace) -> tuple[str, str | None]:
         lib_dir = (tool_root / "third_party" / "ffmpeg" / "lib")
         return str(bundled), (str(lib_dir) if lib_dir.exists() else None)
 
-    ffmpeg = shutil.which("ffmpeg")
+    ffmpeg = shutil.which("ffmpeg", path=path_env)
     if ffmpeg is None:
         raise FileNotFoundError("ffmpeg not found in PATH (or use --ffmpeg)")
     return ffmpeg, None
 
 
+def encode_one(
+    src: Path,
+    args: argparse.Namespace,
+    ffmpeg_path: str,
+    env: dict[str, str],
+    tile_cols: int | None = None,
+) -> Path:
+    stem = src.stem
+    video_path = args.out / f"{stem}.video"
+
+    if args.stream and not args.keep_webm:
+        stream_to_video(src, video_path, args, ffmpeg_path, env, tile_cols)
+        return video_path
+
+    if args.keep_webm:
+        webm_path = args.out / f"{stem}.webm"
+        run_ffmpeg(src, webm_path, args, ffmpeg_path, env, tile_cols)
+        wrap_webm_to_video(webm_path, video_path, args.drop_cache)
+        return video_path
+
+    # A throwaway intermediate is staged privately so it can never land on a source file.
+    with tempfile.TemporaryDirectory(prefix=f".{stem}-", dir=args.out) as tmp:
+        webm_path = Path(tmp) / f"{stem}.webm"
+        run_ffmpeg(src, webm_path, args, ffmpeg_path, env, tile_cols)
+        wrap_webm_to_video(webm_path, video_path, args.drop_cache)
+
+    return video_path
+
+
+def is_up_to_date(src: Path, video_path: Path) -> bool:
+    try:
+        return video_path.stat().st_mtime >= src.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def hash_file(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+    return h.hexdigest()
+
+
+def ffmpeg_version(ffmpeg_path: str, env: dict[str, str]) -> str:
+    proc = subprocess.run(
+        [ffmpeg_path, "-version"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg -version failed\n{proc.stdout}")
+    return proc.stdout.partition("\n")[0]
+
+
+def cache_key(src: Path, args: argparse.Namespace, encoder_id: str) -> str:
+    params = {name: getattr(args, name) for name in CACHE_KEY_ARGS}
+    # Piped WebM has no Cues, so it differs from the wrapped (default or --keep-webm) payload.
+    params["piped"] = args.stream and not args.keep_webm
+    params = json.dumps(params, sort_keys=True)
+    key = f"{VERSION}|{encoder_id}|{hash_file(src)}|{params}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    # Stage next to dst and rename, so an interrupted copy never leaves a truncated file behind.
+    tmp = staging_file(dst)
+    try:
+        tmp.unlink()
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def cache_store(video_path: Path, cache_paths: dict[Path, Path]) -> None:
+    cache_path = cache_paths.get(video_path)
+    if cache_path is not None:
+        link_or_copy(video_path, cache_path)
+
+
+def worker_cpu_sets(jobs: int, threads_per_job: int) -> list[set[int]]:
+    cpus = sorted(os.sched_getaffinity(0))
+    return [{cpus[(i * threads_per_job + k) % len(cpus)] for k in range(threads_per_job)} for i in range(jobs)]
+
+
+def pin_worker(cpu_sets: list[set[int]], counter: itertools.count) -> None:
+    # Affinity is per-thread on Linux, and ffmpeg inherits it from the thread that spawns it.
+    os.sched_setaffinity(0, cpu_sets[next(counter) % len(cpu_sets)])
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Convert videos to WebM (VP9) and wrap into .video")
     parser.add_argument("src", type=Path, help="Input file or directory")
     parser.add_argument("out", type=Path, help="Output directory")
     parser.add_argument("--recursive", action="store_true", help="Scan input directory recursively")
     parser.add_argument("--keep-webm", action="store_true", help="Keep intermediate .webm files")
-    parser.add_argument("--force", action="store_true", help="Overwrite outputs if they exist")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Pipe WebM straight into .video without an intermediate file (output has no seek index)",
+    )
+    parser.add_argument("--force", action="store_true", help="Rebuild outputs even if they are up to date")
     parser.add_argument("--ffmpeg", type=str, default="", help="Path to ffmpeg binary (optional)")
+    parser.add_argument("--jobs", type=int, default=0, help="Parallel ffmpeg jobs (0=auto)")
+    parser.add_argument("--threads-per-job", type=int, default=4, help="ffmpeg threads per job")
+    parser.add_argument(
+        "--pin-cpus",
+        action="store_true",
+        help="Pin each job to its own set of --threads-per-job CPUs (Linux)",
+    )
+    parser.add_argument(
+        "--segment-seconds",
+        type=float,
+        default=0,
+        help="Split each input into ~N second chunks and encode them in parallel (0=off)",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Encode inputs with matching stream layouts in a single ffmpeg run",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Reuse .video files across builds, keyed on input content and encoder settings",
+    )
+    parser.add_argument(
+        "--drop-cache",
+        action="store_true",
+        help="Evict written outputs from the page cache (slower, spares the cache on big builds)",
+    )
 
     # VP9 settings
-    parser.add_argument("--crf", type=int, default=30, help="VP9 quality (lower=better, 15-40 typical)")
+    parser.add_argument(
+        "--encoder",
+        default="libvpx-vp9",
+        choices=["libvpx-vp9", "svt-vp9"],
+        help="VP9 encoder (svt-vp9 needs an ffmpeg built with libsvt_vp9)",
+    )
+    parser.add_argument("--crf", type=int, default=30, help="VP9 quality (lower=better, 15-40 typical; svt-vp9 qp)")
     parser.add_argument("--deadline", default="good", choices=["realtime", "good", "best"], help="Encoding deadline")
-    parser.add_argument("--cpu-used", type=int, default=4, help="VP9 speed/quality tradeoff (0-8)")
+    parser.add_argument("--cpu-used", type=int, default=4, help="VP9 speed/quality tradeoff (0-8; svt-vp9 preset 0-9)")
+
+    # Hardware encoding
+    parser.add_argument(
+        "--hwaccel",
+        default="",
+        choices=["", *HW_ENCODERS],
+        help="Encode on the GPU with a hardware VP9 encoder",
+    )
+    parser.add_argument("--vaapi-device", default="/dev/dri/renderD128", help="VA-API render node for --hwaccel vaapi")
 
     # Audio
     parser.add_argument("--audio", action="store_true", help="Keep audio (Opus)")
     parser.add_argument("--audio-bitrate", type=int, default=128, help="Opus bitrate in kbps")
 
     args = parser.parse_args()
-
-    ffmpeg_path, ffmpeg_lib_dir = resolve_ffmpeg(args)
+    if args.jobs < 0:
+        parser.error("--jobs must be >= 0")
+    if args.threads_per_job < 1:
+        parser.error("--threads-per-job must be >= 1")
+    if args.pin_cpus and not hasattr(os, "sched_setaffinity"):
+        parser.error("--pin-cpus is not supported on this platform")
+    if args.segment_seconds < 0:
+        parser.error("--segment-seconds must be >= 0")
+    if args.batch and args.segment_seconds:
+        parser.error("--batch and --segment-seconds are mutually exclusive")
+    if args.hwaccel and args.encoder != "libvpx-vp9":
+        parser.error("--hwaccel and --encoder are mutually exclusive")
+    jobs = args.jobs or max(1, (os.cpu_count() or 1) // args.threads_per_job)
+
+    ffmpeg_path, ffmpeg_lib_dir = resolve_ffmpeg(args.ffmpeg)
     print(f"Using ffmpeg: {ffmpeg_path}")
     if ffmpeg_lib_dir:
         print(f"Using ffmpeg libs: {ffmpeg_lib_dir}")
@@ -160,24 +869,87 @@ def main() -> int:
         print("No input videos found.")
         return 1
 
-    args.out.mkdir(parents=True, exist_ok=True)
-
+    # Outputs are named by stem alone, so parallel jobs must never share one.
+    by_stem: dict[str, Path] = {}
     for src in inputs:
-        rel = src.name
-        stem = Path(rel).stem
-        webm_path = args.out / f"{stem}.webm"
-        video_path = args.out / f"{stem}.video"
-
-        run_ffmpeg(src, webm_path, args, ffmpeg_path, ffmpeg_lib_dir)
-        wrap_webm_to_video(webm_path, video_path, args.force)
-
-        if not args.keep_webm:
-            try:
-                webm_path.unlink()
-            except FileNotFoundError:
-                pass
+        other = by_stem.setdefault(src.stem, src)
+        if other is not src:
+            raise ValueError(f"Inputs {other} and {src} would both write {src.stem}.video")
+        # Kept intermediates are written as <out>/<stem>.webm with -y, which must never be a source.
+        webm_path = args.out / f"{src.stem}.webm"
+        if args.keep_webm and webm_path.exists() and webm_path.samefile(src):
+            raise ValueError(f"Intermediate {webm_path} would overwrite its source; use another output directory")
 
-        print(f"Built {video_path}")
+    args.out.mkdir(parents=True, exist_ok=True)
+    env = ffmpeg_env(ffmpeg_lib_dir)
+
+    codec = encoder_codec(args)
+    if codec != "libvpx-vp9" and codec not in ffmpeg_encoders(ffmpeg_path, env):
+        raise RuntimeError(f"Encoder {codec} is not available in {ffmpeg_path}")
+
+    pending = []
+    cache_paths: dict[Path, Path] = {}
+    if args.cache_dir:
+        args.cache_dir.mkdir(parents=True, exist_ok=True)
+        # A different ffmpeg/libvpx build may produce different bytes.
+        encoder_id = f"{ffmpeg_path}|{ffmpeg_version(ffmpeg_path, env)}"
+        # --force always re-encodes, and --keep-webm needs the .webm only an encode produces;
+        # both still refresh the stored entry.
+        lookup = not (args.force or args.keep_webm)
+        for src in inputs:
+            video_path = args.out / f"{src.stem}.video"
+            cache_path = args.cache_dir / f"{cache_key(src, args, encoder_id)}.video"
+            # Staleness follows the key, not mtime: an output is current only while it is
+            # still the entry for today's input and settings.
+            if not args.force and video_path.exists() and cache_path.exists() and video_path.samefile(cache_path):
+                print(f"Up-to-date {video_path}")
+                continue
+            if lookup and cache_path.exists():
+                link_or_copy(cache_path, video_path)
+                print(f"Cached {video_path}")
+                continue
+            cache_paths[video_path] = cache_path
+            pending.append(src)
+    else:
+        for src in inputs:
+            video_path = args.out / f"{src.stem}.video"
+            if not args.force:
+                if is_up_to_date(src, video_path):
+                    print(f"Up-to-date {video_path}")
+                    continue
+            pending.append(src)
+
+    # ffmpeg does the heavy lifting in its own process, so threads are enough here.
+    pool_kwargs = {}
+    if args.pin_cpus:
+        pool_kwargs = {
+            "initializer": pin_worker,
+            "initargs": (worker_cpu_sets(jobs, args.threads_per_job), itertools.count()),
+        }
+
+    with ThreadPoolExecutor(max_workers=jobs, **pool_kwargs) as pool:
+        if args.segment_seconds:
+            # One input at a time; its segments fill the pool.
+            for src in pending:
+                video_path = encode_segmented(src, args, ffmpeg_path, env, pool)
+                cache_store(video_path, cache_paths)
+                print(f"Built {video_path}")
+            return 0
+
+        if args.batch:
+            groups = batch_groups(pending, resolve_ffprobe(ffmpeg_path), env, args.audio)
+            batches = [batch for group in groups for batch in split_batch(group, jobs)]
+            futures = [pool.submit(encode_batch, batch, args, ffmpeg_path, env) for batch in batches]
+            for built in wait_all(futures):
+                for video_path in built:
+                    cache_store(video_path, cache_paths)
+                    print(f"Built {video_path}")
+            return 0
+
+        futures = [pool.submit(encode_one, src, args, ffmpeg_path, env) for src in pending]
+        for video_path in wait_all(futures):
+            cache_store(video_path, cache_paths)
+            print(f"Built {video_path}")
 
     return 0
 